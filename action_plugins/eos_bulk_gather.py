@@ -0,0 +1,283 @@
+# Copyright (c) 2017, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# Gather the output of gather_config_commands from every host in the play
+# over eAPI, from a single controller process. The task is meant to run
+# with run_once. Each config is written to the role's disk config store
+# (see config_store in filter_plugins/config_block.py) and only the short
+# handles are returned in 'configs', so the registered result stays small
+# even though it is registered for every host. Each host then picks its
+# own handle. Hosts that could not be reached are reported under
+# 'failed_hosts' and are left to the regular per-host eos_command gather.
+#
+# Requires Python 3.7 or later on the controller.
+
+import asyncio
+import base64
+import json
+import os
+import ssl
+import sys
+
+from ansible.errors import AnsibleError
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+
+
+CONNECTION_ARGS = ('host', 'port', 'username', 'password', 'use_ssl',
+                   'authorize', 'auth_pass', 'validate_certs')
+
+# Ansible connection variables used when neither the role's connection
+# arguments nor provider set a value, e.g. with ansible_connection: httpapi
+CONNECTION_VARS = {
+    'host': ('ansible_host',),
+    'port': ('ansible_httpapi_port',),
+    'username': ('ansible_user',),
+    'password': ('ansible_password', 'ansible_httpapi_pass',
+                 'ansible_httpapi_password'),
+    'use_ssl': ('ansible_httpapi_use_ssl',),
+    'authorize': ('ansible_become',),
+    'auth_pass': ('ansible_become_password', 'ansible_become_pass'),
+    'validate_certs': ('ansible_httpapi_validate_certs',),
+}
+
+ROLE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class EapiError(Exception):
+    pass
+
+
+def _load_filters():
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        'eos_system_config_block',
+        os.path.join(ROLE, 'filter_plugins', 'config_block.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _command_list(commands):
+    # gather_config_commands is a list of strings on Ansible 2.1 and a
+    # list of {command, output} dicts on 2.2+; eAPI only needs the text.
+    cmds = list()
+    for command in commands:
+        if isinstance(command, dict):
+            command = command['command']
+        cmds.append(str(command))
+    return cmds
+
+
+def _decode_chunked(body):
+    data = b''
+    while body:
+        size, _, body = body.partition(b'\r\n')
+        size = int(size.split(b';')[0], 16)
+        if size == 0:
+            break
+        data += body[:size]
+        body = body[size + 2:]
+    return data
+
+
+async def run_commands(params, commands, timeout):
+    use_ssl = params['use_ssl']
+    port = params['port'] or (443 if use_ssl else 80)
+
+    context = None
+    if use_ssl:
+        context = ssl.create_default_context()
+        if not params['validate_certs']:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+
+    cmds = list(commands)
+    if params['authorize']:
+        cmds.insert(0, {'cmd': 'enable', 'input': params['auth_pass'] or ''})
+
+    payload = json.dumps({
+        'jsonrpc': '2.0',
+        'method': 'runCmds',
+        'params': {'version': 1, 'cmds': cmds, 'format': 'text'},
+        'id': params['host'],
+    }).encode('utf-8')
+
+    credentials = '%s:%s' % (params['username'] or '',
+                             params['password'] or '')
+    headers = [
+        'POST /command-api HTTP/1.1',
+        'Host: %s' % params['host'],
+        'Authorization: Basic %s' % base64.b64encode(
+            credentials.encode('utf-8')).decode('ascii'),
+        'Content-Type: application/json',
+        'Content-Length: %d' % len(payload),
+        'Connection: close',
+    ]
+    request = ('\r\n'.join(headers) + '\r\n\r\n').encode('ascii') + payload
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(
+            params['host'], port, ssl=context)
+        try:
+            writer.write(request)
+            await writer.drain()
+            return await reader.read()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                # the reply has been read; a reset or TLS error while
+                # closing does not matter
+                pass
+
+    response = await asyncio.wait_for(exchange(), timeout)
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = lines[0].split(' ', 2)
+    if len(status) < 2 or status[1] != '200':
+        raise EapiError('eAPI request failed: %s' % lines[0])
+    if any(line.lower().startswith('transfer-encoding:') and
+           'chunked' in line.lower() for line in lines[1:]):
+        body = _decode_chunked(body)
+
+    reply = json.loads(body.decode('utf-8'))
+    if 'error' in reply:
+        raise EapiError(reply['error'].get('message', str(reply['error'])))
+
+    result = reply['result']
+    if params['authorize']:
+        result = result[1:]
+    return [item.get('output', '') for item in result]
+
+
+async def gather(hosts, commands, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = dict()
+    failed = dict()
+
+    async def worker(name, params):
+        async with semaphore:
+            try:
+                results[name] = await run_commands(params, commands, timeout)
+            except asyncio.TimeoutError:
+                failed[name] = 'timed out after %s seconds' % timeout
+            except Exception as exc:
+                failed[name] = '%s: %s' % (type(exc).__name__, exc)
+
+    await asyncio.gather(*[worker(name, params)
+                           for name, params in hosts.items()])
+    return results, failed
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+
+    def _host_params(self, hostvars, name):
+        hv = hostvars[name]
+        provider = hv.get('provider') or dict()
+
+        params = dict()
+        for key in CONNECTION_ARGS:
+            value = hv.get(key)
+            if value is None:
+                value = provider.get(key)
+            for var in CONNECTION_VARS[key]:
+                if value is not None:
+                    break
+                value = hv.get(var)
+            params[key] = value
+
+        params['host'] = params['host'] or name
+        params['port'] = int(params['port']) if params['port'] else None
+        params['use_ssl'] = boolean(
+            True if params['use_ssl'] is None else params['use_ssl'])
+        params['authorize'] = boolean(params['authorize'] or False)
+        params['validate_certs'] = boolean(
+            True if params['validate_certs'] is None
+            else params['validate_certs'])
+        return params
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+
+        if sys.version_info < (3, 7):
+            raise AnsibleError('eos_bulk_gather requires Python 3.7 or later '
+                               'on the controller')
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+
+        args = self._task.args
+        commands = args.get('commands',
+                            task_vars.get('gather_config_commands'))
+        if not commands:
+            raise AnsibleError('eos_bulk_gather requires commands')
+        commands = _command_list(commands)
+
+        hosts = args.get('hosts') or task_vars.get('ansible_play_batch') or \
+            task_vars.get('ansible_play_hosts', [])
+        concurrency = int(args.get('concurrency', 100))
+        timeout = int(args.get('timeout', 30))
+        if concurrency < 1:
+            raise AnsibleError('eos_bulk_gather concurrency must be >= 1')
+
+        hostvars = task_vars['hostvars']
+        params = dict()
+        failed = dict()
+        for name in hosts:
+            try:
+                params[name] = self._host_params(hostvars, name)
+            except Exception as exc:
+                failed[name] = 'invalid connection arguments: %s' % exc
+
+        stdout, errors = asyncio.run(
+            gather(params, commands, concurrency, timeout))
+        failed.update(errors)
+
+        filters = _load_filters()
+        configs = dict()
+        for name, output in stdout.items():
+            if not output:
+                failed[name] = 'no output returned'
+                continue
+            try:
+                configs[name] = filters.config_store(output[0], 'disk')
+            except AnsibleError as exc:
+                raise AnsibleError('eos_bulk_gather: %s' % exc)
+
+        result['changed'] = False
+        result['configs'] = configs
+        result['failed_hosts'] = failed
+        return result
@@ -0,0 +1,209 @@
+# Copyright (c) 2017, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# Report how many device connections the EOS tasks of each play set up and
+# how many module runs reused an already open one. With a persistent
+# connection (ansible_connection: httpapi or network_cli) Ansible keeps one
+# session per device open in an ansible-connection process, reachable
+# through a control socket under PERSISTENT_CONTROL_PATH_DIR. Before and
+# after every EOS module run (each loop item counts as a run) the callback
+# checks whether that socket exists: a run that found it already open is a
+# reuse, a run after which it appeared is a setup. When no socket exists
+# after a run the task used a non-persistent connection, which sets up a
+# session for every run. Runs on hosts whose socket path cannot be worked
+# out (e.g. ansible_host refers to an undefined variable) are counted as
+# unknown.
+#
+# Requires Ansible 2.8 or later (v2_runner_on_start). Enable with
+# callback_whitelist = eos_connection_stats in ansible.cfg.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+
+from ansible import constants as C
+from ansible.plugins.callback import CallbackBase
+from ansible.plugins.loader import connection_loader
+from ansible.template import Templar
+
+
+EOS_ACTIONS = ('eos_command', 'eos_config', 'eos_template',
+               'arista.eos.eos_command', 'arista.eos.eos_config')
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'eos_connection_stats'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self._play = None
+        self._sockets = dict()
+        self._open = dict()
+        self._stats = dict()
+
+    def _variables(self, host):
+        try:
+            return self._play.get_variable_manager().get_vars(
+                play=self._play, host=host)
+        except Exception:
+            return host.vars
+
+    def _candidates(self, host):
+        # The control socket is named after a hash of the remote address,
+        # port, user, connection type and ansible-playbook pid (see
+        # ansible-connection). The values are templated like Ansible does
+        # for the play context, and every address, port and user Ansible
+        # may have resolved is tried: the role's connection arguments,
+        # provider (with connection: local the eos action plugins open a
+        # network_cli session to provider.host) and the ansible_* vars.
+        # A value that cannot be templated is left out; when no address or
+        # connection type is left the host has no candidate paths.
+        name = host.get_name()
+        if name not in self._sockets:
+            hv = self._variables(host)
+            templar = Templar(loader=getattr(self._play, '_loader', None),
+                              variables=hv)
+
+            def resolve(key, default=None):
+                if key not in hv:
+                    return default
+                try:
+                    return templar.template(hv[key])
+                except Exception:
+                    return None
+
+            provider = resolve('provider')
+            if not isinstance(provider, dict):
+                provider = dict()
+            connection = resolve('ansible_connection', 'smart')
+            connections = set([connection]) if connection else set()
+            if connection == 'local':
+                connections.add('network_cli')
+            addrs = set([resolve('host'), provider.get('host'),
+                         resolve('ansible_host', name)])
+            ports = set([resolve('port'), provider.get('port'),
+                         resolve('ansible_port'),
+                         resolve('ansible_httpapi_port'),
+                         C.DEFAULT_REMOTE_PORT, None, 22, 80, 443])
+            users = set([resolve('username'), provider.get('username'),
+                         resolve('ansible_user'), C.DEFAULT_REMOTE_USER,
+                         None])
+
+            directory = os.path.expanduser(C.PERSISTENT_CONTROL_PATH_DIR)
+            ssh = connection_loader.get('ssh', class_only=True)
+            paths = set()
+            for conn in connections:
+                for addr in addrs - set([None, '']):
+                    for port in ports:
+                        for user in users:
+                            cpath = ssh._create_control_path(
+                                addr, port, user, conn, os.getpid())
+                            paths.add(cpath % dict(directory=directory))
+            self._sockets[name] = (connection, sorted(paths))
+        return self._sockets[name]
+
+    def _socket_open(self, host):
+        connection, paths = self._candidates(host)
+        return any(os.path.exists(path) for path in paths)
+
+    def _host_stats(self, host):
+        connection, paths = self._candidates(host)
+        return self._stats.setdefault(host.get_name(), {
+            'connection': connection, 'setups': 0, 'reuses': 0,
+            'unknown': 0})
+
+    def _record(self, result):
+        if result._task.action not in EOS_ACTIONS:
+            return
+        host = result._host
+        name = host.get_name()
+
+        stats = self._host_stats(host)
+        if not self._candidates(host)[1]:
+            stats['unknown'] += 1
+            return
+        is_open = self._socket_open(host)
+        if is_open and self._open.get(name):
+            stats['reuses'] += 1
+        else:
+            stats['setups'] += 1
+        self._open[name] = is_open
+
+    def v2_playbook_on_play_start(self, play):
+        self._play = play
+        self._sockets = dict()
+
+    def v2_runner_on_start(self, host, task):
+        if task.action in EOS_ACTIONS:
+            self._open[host.get_name()] = self._socket_open(host)
+
+    def v2_runner_on_ok(self, result):
+        # loop tasks are counted per item
+        if 'results' not in result._result:
+            self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        if 'results' not in result._result:
+            self._record(result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._record(result)
+
+    def v2_runner_item_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_item_on_failed(self, result):
+        self._record(result)
+
+    def v2_playbook_on_stats(self, stats):
+        if not self._stats:
+            return
+
+        data = dict()
+        self._display.banner('EOS CONNECTIONS')
+        for name in sorted(self._stats):
+            host = self._stats[name]
+            data[name] = {'connection': host['connection'],
+                          'setups': host['setups'],
+                          'reuses': host['reuses'],
+                          'unknown': host['unknown']}
+            self._display.display(
+                '%-26s : connection=%s setups=%d reuses=%d unknown=%d'
+                % (name, host['connection'], host['setups'], host['reuses'],
+                   host['unknown']))
+
+        if hasattr(stats, 'set_custom_stats'):
+            stats.set_custom_stats('eos_connections', data)
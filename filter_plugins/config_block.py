@@ -32,10 +32,40 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
-import re
+import base64
 import collections
+import copy
+import fcntl
+import hashlib
+import marshal
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import zlib
 
 from ansible import errors
+from ansible.module_utils.six import string_types
+
+CONFIG_HANDLE = 'eos-config:'
+CONFIG_STORES = ('fact', 'memory', 'disk')
+
+# Parsed configs are cached on disk under the controller's local temp
+# directory, which every fork worker of the run shares, so a config parsed
+# by one worker is loaded by the others instead of being parsed again.
+# ANSIBLE_EOS_PARSE_CACHE_SIZE bounds the cache in megabytes (0 disables it).
+PARSE_CACHE_SIZE = int(os.environ.get('ANSIBLE_EOS_PARSE_CACHE_SIZE', 64))
+MEMO_SIZE = 16
+
+# Constructs that let a pattern match across a line break, or that anchor
+# to the whole text rather than to a line: whitespace and negated classes,
+# escaped newlines, \A and \Z, and inline flags (e.g. (?s)).
+LINE_UNSAFE_RE = re.compile(r'\n|\\[sWDnAZx0uUN]|\[\^|\(\?[aiLmsux-]')
+LITERAL_PREFIX_RE = re.compile(r'\^([^.^$*+?{}\[\]\\|()]*)')
+
+_resolved = dict()
+_memo = collections.OrderedDict()
 
 def parse_config(config, indent=1):
     regexp = re.compile(r'^\s*(.+)$')
@@ -82,23 +112,472 @@ def parse_config(config, indent=1):
     return data
 
 
+def _cache_dir():
+    try:
+        return _private_dir(_local_tmp('eos-parse-cache'))
+    except (AttributeError, ImportError, OSError, TypeError):
+        return None
+
+
+def _cache_evict(path, limit):
+    # Remove the least recently used entries until the cache fits in limit
+    # and return the size left.
+    entries = list()
+    total = 0
+    for name in os.listdir(path):
+        if not name.endswith('.marshal'):
+            continue
+        filename = os.path.join(path, name)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, filename))
+        total += st.st_size
+
+    for mtime, size, filename in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+        total -= size
+    return total
+
+
+def _cache_account(path, size, limit):
+    # Keep a running total of the cache size in a file shared by all the
+    # workers, updated under an exclusive lock. The directory is only
+    # scanned when the total goes over limit, and is then trimmed to three
+    # quarters of it so the next scan is some way off.
+    with open(os.path.join(path, 'size'), 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            total = int(f.read() or 0)
+        except ValueError:
+            total = 0
+        total += size
+        if total > limit:
+            total = _cache_evict(path, limit * 3 // 4)
+        f.seek(0)
+        f.truncate()
+        f.write(str(total))
+
+
+def _plain(data):
+    # marshal only handles the builtin types, so OrderedDicts are stored as
+    # plain dicts; these only keep their order on Python 3.7 and later, so
+    # the disk cache is not used on older versions
+    if isinstance(data, dict):
+        return dict((key, _plain(value)) for key, value in data.items())
+    return data
+
+
+def cached(kind, text, indent, build, disk=True):
+    # Return build() for the given config text, from the in-process memo,
+    # the shared on-disk cache (unless disk is false), or by building it
+    # and storing the result. Entries are written with marshal, which is
+    # several times cheaper than pickle, to a temp name and renamed into
+    # place, so readers never see a partial entry; hits refresh the mtime
+    # used for eviction.
+    key = '%s-%s-%s' % (kind, indent,
+                        hashlib.sha1(text.encode('utf-8')).hexdigest())
+    if key in _memo:
+        data = _memo.pop(key)
+        _memo[key] = data
+        return data
+
+    path = None
+    if disk and PARSE_CACHE_SIZE > 0 and sys.version_info >= (3, 7):
+        path = _cache_dir()
+    filename = path and os.path.join(path, key + '.marshal')
+
+    data = None
+    if filename:
+        try:
+            with open(filename, 'rb') as f:
+                data = marshal.load(f)
+            os.utime(filename, None)
+        except (IOError, OSError, EOFError, TypeError, ValueError):
+            data = None
+        if not isinstance(data, dict):
+            data = None
+
+    if data is None:
+        data = build()
+        if filename:
+            tmpname = None
+            try:
+                fd, tmpname = tempfile.mkstemp(dir=path)
+                with os.fdopen(fd, 'wb') as f:
+                    marshal.dump(_plain(data), f)
+                    size = f.tell()
+                os.rename(tmpname, filename)
+                tmpname = None
+                _cache_account(path, size, PARSE_CACHE_SIZE * 1024 * 1024)
+            except (IOError, OSError, ValueError):
+                pass
+            finally:
+                if tmpname and os.path.exists(tmpname):
+                    os.unlink(tmpname)
+
+    _memo[key] = data
+    while len(_memo) > MEMO_SIZE:
+        _memo.popitem(last=False)
+    return data
+
+
+def load_config(value, indent=1):
+    text = config_text(value)
+    return cached('parse', text, indent,
+                  lambda: parse_config(text.split('\n'), indent))
+
+
+def _private_dir(path):
+    # Create path readable only by the current user, or check that an
+    # existing one is owned by the current user and not writable by others.
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path, 0o700)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise OSError('%s is not owned by the current user or is writable '
+                      'by others' % path)
+    return path
+
+
+def _local_tmp(name):
+    from ansible import constants as C
+    return os.path.join(C.DEFAULT_LOCAL_TMP, name)
+
+
+def config_store(value, store='fact', path=None):
+    # 'memory' returns a handle carrying the zlib compressed config, 'disk'
+    # writes it compressed under path on the controller (by default the
+    # run's local temp directory, removed when the run ends) and returns a
+    # handle naming the file. 'fact' returns the config text. value may
+    # itself be a handle; a disk handle is kept as is for the default path.
+    if store not in CONFIG_STORES:
+        raise errors.AnsibleFilterError(
+            'config_store must be one of %s' % ', '.join(CONFIG_STORES))
+    if isinstance(value, string_types) and value.startswith(CONFIG_HANDLE):
+        if store == 'disk' and not path and \
+                value.startswith(CONFIG_HANDLE + 'file:'):
+            return value
+        value = config_text(value)
+    if store == 'fact':
+        return value
+
+    data = zlib.compress(value.encode('utf-8'))
+    if store == 'memory':
+        return CONFIG_HANDLE + 'zlib:' + base64.b64encode(data).decode('ascii')
+
+    try:
+        path = _private_dir(path or _local_tmp('eos-config-store'))
+    except OSError as exc:
+        raise errors.AnsibleFilterError(
+            'Unable to use config store directory: %s' % exc)
+    filename = os.path.join(path, '%s.z' % hashlib.sha1(data).hexdigest())
+    if not os.path.exists(filename):
+        fd, tmpname = tempfile.mkstemp(dir=path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmpname, filename)
+        except (IOError, OSError):
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+    return CONFIG_HANDLE + 'file:' + filename
+
+
+def config_text(value):
+    # Resolve a handle returned by config_store back to the config text.
+    # Anything that is not a handle is returned unchanged.
+    if not isinstance(value, string_types) or \
+            not value.startswith(CONFIG_HANDLE):
+        return value
+    if value in _resolved:
+        return _resolved[value]
+
+    kind, _, ref = value[len(CONFIG_HANDLE):].partition(':')
+    try:
+        if kind == 'zlib':
+            data = base64.b64decode(ref)
+        elif kind == 'file':
+            with open(ref, 'rb') as f:
+                data = f.read()
+        else:
+            raise ValueError('unknown handle type %s' % kind)
+        text = zlib.decompress(data).decode('utf-8')
+    except (IOError, OSError, ValueError, zlib.error) as exc:
+        raise errors.AnsibleFilterError(
+            'Unable to resolve config handle: %s' % exc)
+
+    _resolved.clear()
+    _resolved[value] = text
+    return text
+
+
+def find_block(config, ancestors):
+    for ancestor in ancestors.split('.'):
+        config = config[ancestor]
+    return config
+
+
 def config_block(value, ancestors, indent=1):
-    config = parse_config(value.split('\n'), indent)
+    config = load_config(value, indent)
     try:
-        for ancestor in ancestors.split('.'):
-            config = config[ancestor]
-        return config.keys()
+        return find_block(config, ancestors).keys()
     except KeyError:
         # raise errors.AnsibleFilterError('Config block not found for parent')
         return None
 
 
+def config_blocks(value, ancestors, indent=1):
+    # Return several config blocks from a single parse of the config.
+    # ancestors is either a list of dotted paths, in which case the
+    # results are keyed by path, or a dict mapping a name to a path.
+    # Paths that are not found are listed under '_missing' instead of
+    # being returned as None.
+    if isinstance(ancestors, dict):
+        paths = ancestors.items()
+    elif isinstance(ancestors, (list, tuple)):
+        paths = [(path, path) for path in ancestors]
+    else:
+        raise errors.AnsibleFilterError(
+            'config_blocks expects a list or dict of ancestor paths')
+
+    config = load_config(value, indent)
+
+    data = collections.OrderedDict()
+    data['_missing'] = list()
+    for name, path in paths:
+        try:
+            data[name] = list(find_block(config, path).keys())
+        except KeyError:
+            data['_missing'].append(name)
+    return data
+
+
+def config_plan(value, config):
+    # Return the lines of a rendered template that are not already present
+    # in config, i.e. the commands a push of the template would send.
+    # Lines are compared stripped, as the role's templates only render
+    # top level commands.
+    current = set(line.strip() for line in config_text(config).split('\n'))
+    plan = list()
+    for line in value.split('\n'):
+        text = line.strip()
+        if not text or text.startswith(('!', '#')) or text in current:
+            continue
+        plan.append(text)
+    return plan
+
+
+def hash_config(config):
+    # Hash every subtree of a parsed config bottom-up. Each line maps to
+    # (digest, hashed children); a digest covers the line and the digests
+    # of its children, regardless of their order.
+    tree = collections.OrderedDict()
+    for line, children in config.items():
+        if line == '_errors':
+            continue
+        subtree = hash_config(children)
+        # the separator keeps the line apart from the fixed length child
+        # digests that follow it
+        digest = hashlib.sha1(line.encode('utf-8') + b'\0')
+        for child in sorted(item[0] for item in subtree.values()):
+            digest.update(child.encode('ascii'))
+        tree[line] = (digest.hexdigest(), subtree)
+    return tree
+
+
+def _hashed_config(text, config, indent):
+    return cached('hash', text, indent, lambda: hash_config(config),
+                  disk=False)
+
+
+def _diff_tree(value, other, blocks, path, result):
+    # blocks holds the parsed value and other trees at path, from which the
+    # added and removed blocks are copied, as they are shared through the
+    # parse cache
+    for line, (digest, subtree) in value.items():
+        if line not in other:
+            result['added'].append({'path': path, 'line': line,
+                                    'block': copy.deepcopy(blocks[0][line])})
+        elif other[line][0] != digest:
+            result['changed'].append(path + [line])
+            _diff_tree(subtree, other[line][1],
+                       (blocks[0][line], blocks[1][line]), path + [line],
+                       result)
+    for line, (digest, subtree) in other.items():
+        if line not in value:
+            result['removed'].append({'path': path, 'line': line,
+                                      'block': copy.deepcopy(blocks[1][line])})
+
+
+def config_diff(value, other, indent=1):
+    # Compare config value (e.g. running) against other (e.g. startup or
+    # a golden config). Subtrees with equal hashes are skipped, so only
+    # the blocks that drifted are walked. 'added' and 'removed' list the
+    # lines (with their child blocks) only present in value or in other,
+    # each with its ancestor path; 'changed' lists the paths of blocks
+    # present in both whose contents differ. Hash trees are only kept in
+    # the in-process memo, not in the disk cache.
+    value = config_text(value)
+    other = config_text(other)
+    blocks = (load_config(value, indent), load_config(other, indent))
+    hashed = (_hashed_config(value, blocks[0], indent),
+              _hashed_config(other, blocks[1], indent))
+
+    result = collections.OrderedDict()
+    result['added'] = list()
+    result['removed'] = list()
+    result['changed'] = list()
+    _diff_tree(hashed[0], hashed[1], blocks, list(), result)
+    return result
+
+
 def re_findall(value, regex):
-    return re.findall(regex, value, re.M)
+    return re.findall(regex, config_text(value), re.M)
 
 
 def re_search(value, regex):
-    return re.search(regex, value, re.M)
+    return re.search(regex, config_text(value), re.M)
+
+
+def _line_prefix(regex):
+    # Return the literal text every match of regex starts a line with, or
+    # None if regex is not anchored to a literal line start or could match
+    # across lines, so that matching it line by line could differ from
+    # matching it over the whole text.
+    if '|' in regex or LINE_UNSAFE_RE.search(regex):
+        return None
+    match = LITERAL_PREFIX_RE.match(regex)
+    if match is None:
+        return None
+    prefix = match.group(1)
+    if regex[match.end():match.end() + 1] in ('*', '?', '{'):
+        # the quantifier makes the last literal character optional
+        prefix = prefix[:-1]
+    return prefix or None
+
+
+def re_multi(value, patterns):
+    # Run several named regular expressions over the config and return a
+    # dict of name to matches, the same as calling re_findall once per
+    # pattern. Patterns anchored to a literal line start (e.g.
+    # '^hostname (\S+)') are dispatched line by line: the config is split
+    # once and each line is only matched against the patterns whose prefix
+    # it starts with. Every other pattern is matched over the whole text on
+    # its own. Each pattern is compiled alone, so backreferences and
+    # conditional group references keep their meaning.
+    if not isinstance(patterns, dict):
+        raise errors.AnsibleFilterError(
+            're_multi expects a dict of name to regular expression')
+
+    text = config_text(value)
+    result = collections.OrderedDict()
+    prefixed = list()
+    for name, regex in patterns.items():
+        compiled = re.compile(regex, re.M)
+        prefix = _line_prefix(regex)
+        if prefix is None:
+            result[name] = compiled.findall(text)
+        else:
+            result[name] = list()
+            prefixed.append((prefix, compiled, result[name]))
+
+    if prefixed:
+        prefixes = tuple(item[0] for item in prefixed)
+        for line in text.split('\n'):
+            if not line.startswith(prefixes):
+                continue
+            for prefix, regex, matches in prefixed:
+                if line.startswith(prefix):
+                    matches.extend(regex.findall(line))
+    return result
+
+
+def _fleet_query(args):
+    # Each config is parsed once here and not needed again, so the parse
+    # cache is bypassed rather than filled with entries that would evict
+    # the ones the per-host tasks reuse.
+    host, config, ancestors, regex, indent = args
+    try:
+        if regex is not None:
+            return host, re_findall(config, regex), None
+        config = parse_config(config_text(config).split('\n'), indent)
+        return host, list(find_block(config, ancestors).keys()), None
+    except KeyError:
+        return host, None, None
+    except Exception as exc:
+        return host, None, '%s: %s' % (type(exc).__name__, exc)
+
+
+def fleet_config_query(hostvars, hosts, ancestors=None, regex=None, indent=1,
+                       processes=None, chunksize=None):
+    # Query the _eos_config of every host in hosts, either for the block
+    # under ancestors (as config_block) or for the matches of regex (as
+    # re_findall), parsing and querying the configs in a process pool.
+    # Results are keyed by host; hosts without a config, or without the
+    # requested block, are listed under '_missing'.
+    if (ancestors is None) == (regex is None):
+        raise errors.AnsibleFilterError(
+            'fleet_config_query expects one of ancestors or regex')
+
+    data = collections.OrderedDict()
+    data['_missing'] = list()
+
+    work = list()
+    for host in hosts:
+        config = hostvars[host].get('_eos_config')
+        if config is None:
+            data['_missing'].append(host)
+        else:
+            work.append((host, config, ancestors, regex, indent))
+
+    processes = int(processes or multiprocessing.cpu_count())
+    processes = max(1, min(processes, len(work)))
+    if not chunksize:
+        chunksize = max(1, len(work) // (processes * 4))
+
+    results = dict()
+    pool = None
+    if processes > 1:
+        try:
+            pool = multiprocessing.get_context('fork').Pool(processes)
+        except (AssertionError, OSError, ValueError):
+            # e.g. no fork start method, or a daemonic parent process
+            pool = None
+
+    if pool is None:
+        rows = (_fleet_query(args) for args in work)
+    else:
+        rows = pool.imap_unordered(_fleet_query, work, int(chunksize))
+    try:
+        for host, value, error in rows:
+            if error is not None:
+                raise errors.AnsibleFilterError(
+                    'fleet_config_query failed for %s: %s' % (host, error))
+            results[host] = value
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    for host, config, ancestors, regex, indent in work:
+        if results[host] is None:
+            data['_missing'].append(host)
+        else:
+            data[host] = results[host]
+    return data
 
 
 class FilterModule(object):
@@ -106,6 +585,13 @@ class FilterModule(object):
     def filters(self):
         return {
             'config_block': config_block,
+            'config_blocks': config_blocks,
+            'config_diff': config_diff,
+            'config_plan': config_plan,
+            'config_store': config_store,
+            'config_text': config_text,
+            'fleet_config_query': fleet_config_query,
             're_findall': re_findall,
+            're_multi': re_multi,
             're_search': re_search,
         }
@@ -0,0 +1,487 @@
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+import glob
+import marshal
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+import unittest
+
+from unittest import mock
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'filter_plugins'))
+
+import config_block  # noqa: E402
+
+from ansible import constants as C  # noqa: E402
+from ansible import errors  # noqa: E402
+
+
+CONFIG = '''hostname leaf1
+ip routing
+interface Ethernet1
+   description uplink
+   shutdown
+interface Management1
+   ip address 10.0.0.1/24
+management api http-commands
+   protocol https
+   no shutdown
+!
+end
+'''
+
+
+class TestConfigStore(unittest.TestCase):
+
+    def setUp(self):
+        self.local_tmp = C.DEFAULT_LOCAL_TMP
+        C.DEFAULT_LOCAL_TMP = tempfile.mkdtemp()
+        self.path = os.path.join(C.DEFAULT_LOCAL_TMP, 'eos-config-store')
+
+    def tearDown(self):
+        shutil.rmtree(C.DEFAULT_LOCAL_TMP)
+        C.DEFAULT_LOCAL_TMP = self.local_tmp
+
+    def test_fact(self):
+        self.assertEqual(config_block.config_store(CONFIG), CONFIG)
+        self.assertEqual(config_block.config_store(CONFIG, 'fact'), CONFIG)
+
+    def test_memory(self):
+        handle = config_block.config_store(CONFIG, 'memory')
+        self.assertTrue(handle.startswith('eos-config:zlib:'))
+        self.assertEqual(config_block.config_text(handle), CONFIG)
+        self.assertEqual(config_block.config_store(handle, 'fact'), CONFIG)
+
+    def test_disk(self):
+        handle = config_block.config_store(CONFIG, 'disk')
+        filename = handle[len('eos-config:file:'):]
+        self.assertEqual(os.path.dirname(filename), self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o700)
+        self.assertEqual(config_block.config_text(handle), CONFIG)
+        self.assertEqual(config_block.config_store(CONFIG, 'disk'), handle)
+        self.assertEqual(os.listdir(self.path), [os.path.basename(filename)])
+
+    def test_disk_handles(self):
+        handle = config_block.config_store(CONFIG, 'disk')
+        self.assertIs(config_block.config_store(handle, 'disk'), handle)
+
+        path = os.path.join(C.DEFAULT_LOCAL_TMP, 'archive')
+        moved = config_block.config_store(handle, 'disk', path)
+        self.assertEqual(moved, 'eos-config:file:' + os.path.join(
+            path, os.path.basename(handle)))
+        self.assertEqual(config_block.config_text(moved), CONFIG)
+
+        memory = config_block.config_store(handle, 'memory')
+        self.assertEqual(config_block.config_text(memory), CONFIG)
+
+    def test_unknown_store(self):
+        self.assertRaises(errors.AnsibleFilterError,
+                          config_block.config_store, CONFIG, 'redis')
+
+    def test_insecure_directory(self):
+        path = os.path.join(C.DEFAULT_LOCAL_TMP, 'shared')
+        os.mkdir(path)
+        os.chmod(path, 0o777)
+        self.assertRaises(errors.AnsibleFilterError,
+                          config_block.config_store, CONFIG, 'disk', path)
+        os.chmod(path, 0o750)
+        config_block.config_store(CONFIG, 'disk', path)
+        os.chmod(path, 0o770)
+        self.assertRaises(errors.AnsibleFilterError,
+                          config_block.config_store, CONFIG, 'disk', path)
+
+    def test_foreign_directory(self):
+        uid = os.getuid() + 1
+        with mock.patch.object(config_block.os, 'getuid', lambda: uid):
+            self.assertRaises(errors.AnsibleFilterError,
+                              config_block.config_store, CONFIG, 'disk')
+
+    def test_filters_resolve_handles(self):
+        for store in ('memory', 'disk'):
+            handle = config_block.config_store(CONFIG, store)
+            self.assertEqual(
+                list(config_block.config_block(handle, 'interface Ethernet1',
+                                               3)),
+                ['description uplink', 'shutdown'])
+            self.assertEqual(config_block.re_search(
+                handle, r'^hostname (\S+)').group(1), 'leaf1')
+            self.assertEqual(config_block.re_findall(
+                handle, r'^interface (\S+)'), ['Ethernet1', 'Management1'])
+
+    def test_invalid_handles(self):
+        for handle in ('eos-config:zlib:!!!', 'eos-config:file:/nonexistent',
+                       'eos-config:s3:bucket'):
+            self.assertRaises(errors.AnsibleFilterError,
+                              config_block.config_text, handle)
+
+
+class TestConfigBlocks(unittest.TestCase):
+
+    def test_list_of_paths(self):
+        data = config_block.config_blocks(
+            CONFIG, ['interface Ethernet1', 'management api http-commands'], 3)
+        self.assertEqual(data['_missing'], [])
+        self.assertEqual(data['interface Ethernet1'],
+                         ['description uplink', 'shutdown'])
+        self.assertEqual(data['management api http-commands'],
+                         ['protocol https', 'no shutdown'])
+
+    def test_dict_of_paths(self):
+        data = config_block.config_blocks(
+            CONFIG, {'mgmt': 'interface Management1'}, 3)
+        self.assertEqual(data['mgmt'], ['ip address 10.0.0.1/24'])
+
+    def test_missing_paths(self):
+        data = config_block.config_blocks(
+            CONFIG, {'et1': 'interface Ethernet1',
+                     'et2': 'interface Ethernet2',
+                     'aaa': 'aaa root.secret'}, 3)
+        self.assertEqual(sorted(data['_missing']), ['aaa', 'et2'])
+        self.assertNotIn('et2', data)
+        self.assertNotIn('aaa', data)
+        self.assertEqual(data['et1'], ['description uplink', 'shutdown'])
+
+    def test_invalid_paths(self):
+        self.assertRaises(errors.AnsibleFilterError,
+                          config_block.config_blocks,
+                          CONFIG, 'interface Ethernet1', 3)
+
+
+class TestConfigDiff(unittest.TestCase):
+
+    def test_equal(self):
+        data = config_block.config_diff(CONFIG, CONFIG, 3)
+        self.assertEqual(data['added'], [])
+        self.assertEqual(data['removed'], [])
+        self.assertEqual(data['changed'], [])
+
+    def test_top_level(self):
+        other = CONFIG.replace('ip routing\n', 'no ip routing\n')
+        data = config_block.config_diff(CONFIG, other, 3)
+        self.assertEqual([(e['path'], e['line']) for e in data['added']],
+                         [([], 'ip routing')])
+        self.assertEqual([(e['path'], e['line']) for e in data['removed']],
+                         [([], 'no ip routing')])
+        self.assertEqual(data['changed'], [])
+
+    def test_added_and_removed_blocks(self):
+        value = CONFIG + 'interface Ethernet2\n   mtu 9000\n'
+        data = config_block.config_diff(value, CONFIG, 3)
+        self.assertEqual(len(data['added']), 1)
+        self.assertEqual(data['added'][0]['line'], 'interface Ethernet2')
+        self.assertEqual(list(data['added'][0]['block']), ['mtu 9000'])
+
+        data = config_block.config_diff(CONFIG, value, 3)
+        self.assertEqual([e['line'] for e in data['removed']],
+                         ['interface Ethernet2'])
+        self.assertEqual(data['added'], [])
+
+    def test_changed_block(self):
+        other = CONFIG.replace('description uplink', 'description spare')
+        data = config_block.config_diff(CONFIG, other, 3)
+        self.assertEqual(data['changed'], [['interface Ethernet1']])
+        self.assertEqual(data['added'], [{
+            'path': ['interface Ethernet1'],
+            'line': 'description uplink', 'block': {}}])
+        self.assertEqual(data['removed'], [{
+            'path': ['interface Ethernet1'],
+            'line': 'description spare', 'block': {}}])
+
+    def test_nested_change(self):
+        value = 'router bgp 65000\n   vrf red\n      rd 1:1\n' \
+                '   vrf blue\n      rd 2:2\n'
+        other = value.replace('rd 1:1', 'rd 1:2')
+        data = config_block.config_diff(value, other, 3)
+        self.assertEqual(data['changed'], [['router bgp 65000'],
+                                           ['router bgp 65000', 'vrf red']])
+        self.assertEqual([(e['path'], e['line']) for e in data['added']],
+                         [(['router bgp 65000', 'vrf red'], 'rd 1:1')])
+        self.assertEqual([(e['path'], e['line']) for e in data['removed']],
+                         [(['router bgp 65000', 'vrf red'], 'rd 1:2')])
+
+    def test_blocks_are_copies(self):
+        value = CONFIG + 'interface Ethernet2\n   mtu 9000\n'
+        data = config_block.config_diff(value, CONFIG, 3)
+        data['added'][0]['block']['shutdown'] = {}
+        self.assertEqual(
+            list(config_block.config_block(value, 'interface Ethernet2', 3)),
+            ['mtu 9000'])
+
+
+class TestConfigPlan(unittest.TestCase):
+
+    def test_missing_lines(self):
+        rendered = 'hostname leaf2\nip routing\nusername bob nopassword\n'
+        self.assertEqual(config_block.config_plan(rendered, CONFIG),
+                         ['hostname leaf2', 'username bob nopassword'])
+
+    def test_comments_and_blank_lines(self):
+        rendered = '#jinja2: trim_blocks: False\n! comment\n# note\n' \
+                   '\n   \nhostname leaf1\n'
+        self.assertEqual(config_block.config_plan(rendered, CONFIG), [])
+
+    def test_stripped_lines(self):
+        rendered = '  ip routing  \n   description uplink\n   mtu 9000\n'
+        self.assertEqual(config_block.config_plan(rendered, CONFIG),
+                         ['mtu 9000'])
+
+    def test_handles(self):
+        handle = config_block.config_store(CONFIG, 'memory')
+        self.assertEqual(config_block.config_plan('hostname leaf1', handle),
+                         [])
+
+
+class TestReMulti(unittest.TestCase):
+
+    def assertFindall(self, text, patterns):
+        self.assertEqual(
+            dict(config_block.re_multi(text, patterns)),
+            dict((name, re.findall(regex, text, re.M))
+                 for name, regex in patterns.items()))
+
+    def test_named_patterns(self):
+        self.assertFindall(CONFIG, {
+            'hostname': r'^hostname (\S+)',
+            'routing': r'^ip routing$',
+            'interfaces': r'^interface (\S+)',
+            'none': r'^aaa root'})
+
+    def test_groups(self):
+        data = config_block.re_multi(CONFIG, {
+            'address': r'ip address (\d+\.\d+\.\d+\.\d+)/(\d+)'})
+        self.assertEqual(data['address'], [('10.0.0.1', '24')])
+
+    def test_overlapping_patterns(self):
+        text = 'username admin privilege 15\nusername bob privilege 1\n'
+        self.assertFindall(text, {'users': r'^username (\S+)',
+                                  'admin': r'^username admin'})
+        self.assertFindall(text, {'admin': r'^username admin',
+                                  'users': r'^username (\S+)'})
+
+    def test_optional_groups(self):
+        self.assertFindall('ab b\n', {'optional': r'(a)?b'})
+        self.assertEqual(config_block.re_multi('ab b\n', {'o': r'(a)?b'}),
+                         {'o': ['a', '']})
+
+    def test_backreferences(self):
+        self.assertFindall('aa ab\nhostname x\n', {'double': r'(a)\1',
+                                                   'hostname': r'^hostname'})
+
+    def test_conditional_references(self):
+        data = config_block.re_multi('ab ab', {'x': r'(a)(?(1)b|c)',
+                                               'y': 'b'})
+        self.assertEqual(data['x'], ['a', 'a'])
+        self.assertEqual(data['y'], ['b', 'b'])
+
+    def test_patterns_across_lines(self):
+        text = 'hostname\n   leaf1\nhostname x\n\nip routing\n'
+        self.assertFindall(text, {'spaces': r'^hostname\s+(\S+)',
+                                  'newline': r'^hostname\n(.*)',
+                                  'negated': r'^hostname[^x]+',
+                                  'start': r'\A(\w+)',
+                                  'dotall': r'(?s)^hostname.x',
+                                  'prefix': r'^hostname (\S+)',
+                                  'optional': r'^ip?'})
+
+    def test_faster_than_findall(self):
+        lines = ['hostname leaf1', 'ip routing']
+        for index in range(3000):
+            lines += ['interface Ethernet%d' % index,
+                      '   description link %d' % index,
+                      '   mtu 9000',
+                      '   no shutdown']
+            if index % 50 == 0:
+                lines.append('username user%d privilege 1' % index)
+        text = '\n'.join(lines) + '\n'
+        patterns = {'hostname': r'^hostname (\S+)',
+                    'routing': r'^ip routing$',
+                    'users': r'^username (\S+)',
+                    'interfaces': r'^interface (\S+)',
+                    'mtu': r'mtu (\d+)'}
+        self.assertFindall(text, patterns)
+
+        def findall():
+            for regex in patterns.values():
+                re.findall(regex, text, re.M)
+
+        def multi():
+            config_block.re_multi(text, patterns)
+
+        self.assertLess(min(timeit.repeat(multi, number=5, repeat=5)),
+                        min(timeit.repeat(findall, number=5, repeat=5)))
+
+    def test_invalid_patterns(self):
+        self.assertRaises(errors.AnsibleFilterError, config_block.re_multi,
+                          CONFIG, [r'^hostname'])
+
+
+def _cache_hit(text):
+    # run in a forked child: fail unless the entry is read from disk
+    config_block._memo.clear()
+
+    def build():
+        raise AssertionError('cache miss')
+
+    config_block.cached('test', text, 3, build)
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'disk cache requires 3.7')
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.local_tmp = C.DEFAULT_LOCAL_TMP
+        self.cache_size = config_block.PARSE_CACHE_SIZE
+        C.DEFAULT_LOCAL_TMP = tempfile.mkdtemp()
+        self.path = os.path.join(C.DEFAULT_LOCAL_TMP, 'eos-parse-cache')
+        config_block._memo.clear()
+
+    def tearDown(self):
+        shutil.rmtree(C.DEFAULT_LOCAL_TMP)
+        C.DEFAULT_LOCAL_TMP = self.local_tmp
+        config_block.PARSE_CACHE_SIZE = self.cache_size
+        config_block._memo.clear()
+
+    def entries(self):
+        return glob.glob(os.path.join(self.path, '*.marshal'))
+
+    def test_hit_from_other_process(self):
+        data = config_block.load_config(CONFIG, 3)
+        self.assertEqual(len(self.entries()), 1)
+        with open(self.entries()[0], 'rb') as f:
+            self.assertEqual(marshal.load(f), data)
+
+        process = multiprocessing.get_context('fork').Process(
+            target=_cache_hit, args=(CONFIG,))
+        config_block.cached('test', CONFIG, 3, lambda: data)
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+    def test_size_and_eviction(self):
+        config_block.PARSE_CACHE_SIZE = 1
+        sizes = list()
+        for index in range(4):
+            text = 'config %d' % index
+            config_block.cached('test', text, 1, lambda: {
+                'line %d' % i: {} for i in range(20000 + index)})
+            filename, = [name for name in self.entries()
+                         if name not in [item[0] for item in sizes]]
+            os.utime(filename, (index, index))
+            sizes.append((filename, os.path.getsize(filename)))
+
+        self.assertGreater(sum(size for name, size in sizes), 1024 * 1024)
+        remaining = sorted(self.entries())
+        self.assertEqual(remaining, sorted(name for name, size in sizes[-2:]))
+        with open(os.path.join(self.path, 'size')) as f:
+            self.assertEqual(int(f.read()),
+                             sum(os.path.getsize(name) for name in remaining))
+
+    def test_hash_trees_in_memory_only(self):
+        other = CONFIG.replace('ip routing\n', '')
+        config_block.config_diff(CONFIG, other, 3)
+        names = sorted(os.path.basename(name) for name in self.entries())
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.startswith('parse-') for name in names))
+        hashed = [value for key, value in config_block._memo.items()
+                  if key.startswith('hash-')]
+        self.assertEqual(len(hashed), 2)
+        self.assertEqual(len(hashed[0]['interface Ethernet1']), 2)
+
+    def test_disabled(self):
+        config_block.PARSE_CACHE_SIZE = 0
+        config_block.load_config(CONFIG, 3)
+        self.assertEqual(self.entries(), [])
+
+    def test_corrupt_entries(self):
+        expected = config_block.load_config(CONFIG, 3)
+        filename, = self.entries()
+        with open(filename, 'rb') as f:
+            good = f.read()
+
+        for junk in (b'', good[:len(good) // 2], b'\xff' * 64,
+                     marshal.dumps(42)):
+            with open(filename, 'wb') as f:
+                f.write(junk)
+            config_block._memo.clear()
+            self.assertEqual(config_block.load_config(CONFIG, 3), expected)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), good)
+
+
+class TestFleetConfigQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.hostvars = dict()
+        for index in range(1, 9):
+            name = 'leaf%d' % index
+            self.hostvars[name] = {
+                '_eos_config': CONFIG.replace('leaf1', name)}
+        self.hostvars['spine1'] = {'_eos_config': 'hostname spine1\n'}
+        self.hostvars['noconfig'] = dict()
+        self.hosts = sorted(self.hostvars)
+
+    def check_blocks(self, data):
+        self.assertEqual(sorted(data['_missing']), ['noconfig', 'spine1'])
+        for index in range(1, 9):
+            self.assertEqual(data['leaf%d' % index],
+                             ['description uplink', 'shutdown'])
+        self.assertEqual(list(data)[1:], ['leaf%d' % i for i in range(1, 9)])
+
+    def test_block_serial(self):
+        self.check_blocks(config_block.fleet_config_query(
+            self.hostvars, self.hosts, 'interface Ethernet1', indent=3,
+            processes=1))
+
+    def test_block_pool(self):
+        self.check_blocks(config_block.fleet_config_query(
+            self.hostvars, self.hosts, 'interface Ethernet1', indent=3,
+            processes=2, chunksize=3))
+
+    def test_regex(self):
+        for processes in (1, 2):
+            data = config_block.fleet_config_query(
+                self.hostvars, self.hosts, regex=r'^hostname (\S+)',
+                processes=processes)
+            self.assertEqual(data['_missing'], ['noconfig'])
+            self.assertEqual(data['spine1'], ['spine1'])
+            self.assertEqual(data['leaf3'], ['leaf3'])
+
+    def test_handles(self):
+        hostvars = {'leaf1': {'_eos_config': config_block.config_store(
+            CONFIG, 'memory')}}
+        data = config_block.fleet_config_query(
+            hostvars, ['leaf1'], 'interface Management1', indent=3)
+        self.assertEqual(data['leaf1'], ['ip address 10.0.0.1/24'])
+
+    def test_bypasses_parse_cache(self):
+        local_tmp = C.DEFAULT_LOCAL_TMP
+        C.DEFAULT_LOCAL_TMP = tempfile.mkdtemp()
+        config_block._memo.clear()
+        try:
+            self.check_blocks(config_block.fleet_config_query(
+                self.hostvars, self.hosts, 'interface Ethernet1', indent=3,
+                processes=1))
+            self.assertEqual(len(config_block._memo), 0)
+            self.assertEqual(os.listdir(C.DEFAULT_LOCAL_TMP), [])
+        finally:
+            shutil.rmtree(C.DEFAULT_LOCAL_TMP)
+            C.DEFAULT_LOCAL_TMP = local_tmp
+
+    def test_arguments(self):
+        self.assertRaises(errors.AnsibleFilterError,
+                          config_block.fleet_config_query,
+                          self.hostvars, self.hosts)
+        self.assertRaises(errors.AnsibleFilterError,
+                          config_block.fleet_config_query,
+                          self.hostvars, self.hosts, 'hostname', '^hostname')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+import asyncio
+import base64
+import importlib.util
+import json
+import os
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+SPEC = importlib.util.spec_from_file_location(
+    'eos_bulk_gather',
+    os.path.join(os.path.dirname(HERE), 'action_plugins',
+                 'eos_bulk_gather.py'))
+eos_bulk_gather = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(eos_bulk_gather)
+
+
+class EapiHandler(BaseHTTPRequestHandler):
+    # The username picks the behaviour: ok, slow, denied, error or enable.
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(
+            int(self.headers['Content-Length'])).decode('utf-8'))
+        credentials = base64.b64decode(
+            self.headers['Authorization'].split()[1]).decode('utf-8')
+        user = credentials.split(':')[0]
+        cmds = request['params']['cmds']
+
+        if user == 'slow':
+            time.sleep(1)
+        if user == 'denied':
+            return self.reply(401, {})
+        if user == 'error':
+            return self.reply(200, {'jsonrpc': '2.0', 'id': request['id'],
+                                    'error': {'code': 1002,
+                                              'message': 'invalid command'}})
+
+        result = list()
+        for cmd in cmds:
+            if isinstance(cmd, dict):
+                result.append({'output': 'enabled with %s\n' % cmd['input']})
+            else:
+                result.append({'output': 'output of %s\n' % cmd})
+        self.reply(200, {'jsonrpc': '2.0', 'id': request['id'],
+                         'result': result})
+
+
+class EapiServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestHostParams(unittest.TestCase):
+
+    def host_params(self, hostvars, name='leaf1'):
+        action = eos_bulk_gather.ActionModule.__new__(
+            eos_bulk_gather.ActionModule)
+        return action._host_params(hostvars, name)
+
+    def test_precedence(self):
+        params = self.host_params({'leaf1': {
+            'host': '10.0.0.1',
+            'username': 'role',
+            'provider': {'host': '10.0.0.2', 'username': 'provider',
+                         'password': 'secret', 'port': '8443'},
+            'ansible_host': '10.0.0.3',
+            'ansible_user': 'ansible',
+            'ansible_password': 'other',
+            'ansible_httpapi_port': 443,
+            'ansible_become': True}})
+        self.assertEqual(params['host'], '10.0.0.1')
+        self.assertEqual(params['username'], 'role')
+        self.assertEqual(params['password'], 'secret')
+        self.assertEqual(params['port'], 8443)
+        self.assertTrue(params['authorize'])
+
+    def test_ansible_vars(self):
+        params = self.host_params({'leaf1': {
+            'ansible_host': '10.0.0.3',
+            'ansible_user': 'ansible',
+            'ansible_httpapi_pass': 'secret',
+            'ansible_httpapi_use_ssl': 'false',
+            'ansible_become_pass': 'enable'}})
+        self.assertEqual(params['host'], '10.0.0.3')
+        self.assertEqual(params['username'], 'ansible')
+        self.assertEqual(params['password'], 'secret')
+        self.assertFalse(params['use_ssl'])
+        self.assertEqual(params['auth_pass'], 'enable')
+
+    def test_defaults(self):
+        params = self.host_params({'leaf1': {}})
+        self.assertEqual(params['host'], 'leaf1')
+        self.assertIsNone(params['port'])
+        self.assertTrue(params['use_ssl'])
+        self.assertTrue(params['validate_certs'])
+        self.assertFalse(params['authorize'])
+
+        params = self.host_params({'leaf1': {'validate_certs': False,
+                                             'use_ssl': False}})
+        self.assertFalse(params['use_ssl'])
+        self.assertFalse(params['validate_certs'])
+
+
+class TestDecodeChunked(unittest.TestCase):
+
+    def test_chunks(self):
+        body = b'5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\n\r\n'
+        self.assertEqual(eos_bulk_gather._decode_chunked(body),
+                         b'hello, world')
+
+    def test_empty(self):
+        self.assertEqual(eos_bulk_gather._decode_chunked(b'0\r\n\r\n'), b'')
+
+
+class TestGather(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EapiServer(('127.0.0.1', 0), EapiHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def params(self, username, authorize=False):
+        return {'host': '127.0.0.1', 'port': self.server.server_address[1],
+                'username': username, 'password': 'secret',
+                'use_ssl': False, 'validate_certs': True,
+                'authorize': authorize, 'auth_pass': 'enable'}
+
+    def gather(self, hosts, timeout=5):
+        return asyncio.run(eos_bulk_gather.gather(
+            hosts, ['show running-config'], 2, timeout))
+
+    def test_output(self):
+        results, failed = self.gather({'leaf1': self.params('ok')})
+        self.assertEqual(results,
+                         {'leaf1': ['output of show running-config\n']})
+        self.assertEqual(failed, {})
+
+    def test_enable_output_stripped(self):
+        results, failed = self.gather({'leaf1': self.params('enable', True)})
+        self.assertEqual(results,
+                         {'leaf1': ['output of show running-config\n']})
+
+    def test_failures(self):
+        results, failed = self.gather({
+            'leaf1': self.params('ok'),
+            'leaf2': self.params('slow'),
+            'leaf3': self.params('denied'),
+            'leaf4': self.params('error')}, timeout=0.3)
+        self.assertEqual(sorted(results), ['leaf1'])
+        self.assertEqual(failed['leaf2'], 'timed out after 0.3 seconds')
+        self.assertEqual(failed['leaf3'],
+                         'EapiError: eAPI request failed: '
+                         'HTTP/1.0 401 Unauthorized')
+        self.assertEqual(failed['leaf4'], 'EapiError: invalid command')
+
+
+if __name__ == '__main__':
+    unittest.main()
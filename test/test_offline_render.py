@@ -0,0 +1,105 @@
+# pylint: disable=invalid-name
+# pylint: disable=missing-docstring
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+import jinja2
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+SPEC = importlib.util.spec_from_file_location(
+    'offline_render',
+    os.path.join(os.path.dirname(HERE), 'tools', 'offline_render.py'))
+offline_render = importlib.util.module_from_spec(SPEC)
+SPEC.loader.exec_module(offline_render)
+
+
+INVENTORY = '''# fabric
+[spines]
+spine1
+
+[leafs]
+leaf1 ansible_host=10.0.0.1
+leaf2
+
+[border]
+leaf2 ; also a leaf
+
+[fabric:children]
+spines
+leafs
+
+[dc:children]
+fabric
+
+[leafs:vars]
+ntp=10.0.0.254
+'''
+
+
+class TestLoadInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.inventory = os.path.join(self.path, 'hosts')
+        with open(self.inventory, 'w') as f:
+            f.write(INVENTORY)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parents_before_children(self):
+        hosts = offline_render.load_inventory(self.inventory)
+        self.assertEqual(hosts['spine1'], ['dc', 'fabric', 'spines'])
+        self.assertEqual(hosts['leaf1'], ['dc', 'fabric', 'leafs'])
+        self.assertEqual(hosts['leaf2'], ['border', 'dc', 'fabric', 'leafs'])
+
+    def test_vars_and_children_sections(self):
+        hosts = offline_render.load_inventory(self.inventory)
+        # neither variable names nor child groups are taken for hosts
+        self.assertEqual(sorted(hosts), ['leaf1', 'leaf2', 'spine1'])
+
+
+class TestTemplateVars(unittest.TestCase):
+
+    def setUp(self):
+        offline_render._strict = jinja2.Environment(
+            undefined=jinja2.StrictUndefined)
+
+    def tearDown(self):
+        offline_render._strict = None
+
+    def test_native_types(self):
+        variables = offline_render.template_vars({
+            'enabled': '{{ true }}',
+            'count': '{{ 2 + 3 }}',
+            'names': "{{ ['a', 'b'] }}",
+            'text': 'vlan {{ 10 }}'})
+        self.assertIs(variables['enabled'], True)
+        self.assertEqual(variables['count'], 5)
+        self.assertEqual(variables['names'], ['a', 'b'])
+        self.assertEqual(variables['text'], 'vlan 10')
+
+    def test_nested_references(self):
+        variables = offline_render.template_vars({
+            'inventory_hostname': 'leaf1',
+            'fqdn': '{{ hostname }}.example.com',
+            'hostname': '{{ inventory_hostname }}',
+            'users': [{'name': 'admin', 'host': '{{ fqdn }}'}]})
+        self.assertEqual(variables['hostname'], 'leaf1')
+        self.assertEqual(variables['fqdn'], 'leaf1.example.com')
+        self.assertEqual(variables['users'],
+                         [{'name': 'admin', 'host': 'leaf1.example.com'}])
+
+    def test_undefined(self):
+        self.assertRaises(jinja2.UndefinedError, offline_render.template_vars,
+                          {'hostname': '{{ missing }}'})
+        self.assertRaises(jinja2.UndefinedError, offline_render.template_vars,
+                          {'hostname': 'leaf-{{ missing }}'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# Copyright (c) 2017, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+# Render the EOS System role against archived running-configs without
+# touching any device. Each host's config is read from
+# <snapshots>/<host>.cfg. Its variables are layered like Ansible does:
+# the role defaults, <group-vars>/all, <group-vars>/<group> for the groups
+# the host belongs to in an INI --inventory (parents before children),
+# <host-vars>/<host>, then any --vars files. Variable values are templated
+# with Jinja2 against each other and inventory_hostname; only the role's
+# filters are available, not Ansible's own filters or lookups. The
+# hostname, ip_routing and users templates are rendered with the same
+# when conditions as the role tasks and the commands that are not already
+# in the config are written as one JSON object per host:
+#
+#   {"host": "leaf1", "commands": ["hostname leaf1", "ip routing"]}
+#
+# Hosts are rendered in a process pool and results are streamed as they
+# complete.
+#
+# usage: tools/offline_render.py --snapshots DIR [--host-vars DIR]
+#                                [--group-vars DIR] [--inventory FILE]
+#                                [--vars FILE ...] [--processes N]
+#                                [--output FILE] [HOST ...]
+
+from __future__ import (absolute_import, division, print_function)
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import re
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+
+import jinja2
+import yaml
+
+ROLE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXPRESSION_RE = re.compile(r'^\s*\{\{(.*)\}\}\s*$', re.S)
+TEMPLATE_PASSES = 10
+
+_env = None
+_strict = None
+_args = None
+_defaults = None
+_groups = None
+_group_vars = dict()
+
+
+def load_yaml(path):
+    with open(path) as f:
+        return yaml.safe_load(f) or dict()
+
+
+def load_vars(directory, name):
+    # <directory>/<name>.yml (or .yaml/.json), or every file in the
+    # <directory>/<name>/ directory, as Ansible reads host and group vars
+    variables = dict()
+    if not directory:
+        return variables
+    for ext in ('.yml', '.yaml', '.json'):
+        path = os.path.join(directory, name + ext)
+        if os.path.exists(path):
+            variables.update(load_yaml(path))
+            break
+    path = os.path.join(directory, name)
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith(('.yml', '.yaml', '.json')):
+                variables.update(load_yaml(os.path.join(path, filename)))
+    return variables
+
+
+def load_inventory(path):
+    # Return the groups of every host in an INI inventory, ordered parents
+    # before children, which is the order Ansible applies group_vars in.
+    members = dict()
+    children = dict()
+    section, kind = 'ungrouped', None
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].split(';', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                section, _, kind = line[1:-1].partition(':')
+                continue
+            if kind == 'children':
+                children.setdefault(section, set()).add(line.split()[0])
+            elif not kind:
+                members.setdefault(section, set()).add(line.split()[0])
+
+    parents = dict()
+    for parent, groups in children.items():
+        for group in groups:
+            parents.setdefault(group, set()).add(parent)
+
+    def depth(group, seen=()):
+        if group in seen:
+            return 0
+        return 1 + max([depth(p, seen + (group,))
+                        for p in parents.get(group, ())] or [0])
+
+    def ancestors(group, seen=()):
+        result = set([group])
+        for parent in parents.get(group, ()):
+            if parent not in seen:
+                result |= ancestors(parent, seen + (group,))
+        return result
+
+    hosts = dict()
+    for group, names in members.items():
+        for name in names:
+            hosts.setdefault(name, set()).update(ancestors(group))
+    return dict((name, sorted(groups, key=lambda g: (depth(g), g)))
+                for name, groups in hosts.items())
+
+
+def template_value(value, variables):
+    if isinstance(value, dict):
+        return dict((k, template_value(v, variables))
+                    for k, v in value.items())
+    if isinstance(value, list):
+        return [template_value(v, variables) for v in value]
+    if isinstance(value, str) and ('{{' in value or '{%' in value):
+        # a value that is a single expression keeps its native type, as
+        # Ansible does, so e.g. "{{ true }}" stays a boolean
+        match = EXPRESSION_RE.match(value)
+        if match and '{{' not in match.group(1):
+            result = _strict.compile_expression(
+                match.group(1), undefined_to_none=False)(**variables)
+            if isinstance(result, jinja2.Undefined):
+                raise jinja2.UndefinedError(
+                    "'%s' is undefined" % match.group(1).strip())
+            return result
+        return _strict.from_string(value).render(variables)
+    return value
+
+
+def template_vars(variables):
+    # template the values against each other until nothing changes, so
+    # values referring to other templated values resolve too
+    for _ in range(TEMPLATE_PASSES):
+        templated = dict((k, template_value(v, variables))
+                         for k, v in variables.items())
+        if templated == variables:
+            break
+        variables = templated
+    return variables
+
+
+def init_worker(args):
+    global _env, _strict, _args, _defaults, _groups
+
+    spec = importlib.util.spec_from_file_location(
+        'config_block',
+        os.path.join(ROLE, 'filter_plugins', 'config_block.py'))
+    filters = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(filters)
+
+    _env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(os.path.join(ROLE, 'templates')),
+        trim_blocks=True)
+    _env.filters.update(filters.FilterModule().filters())
+    _strict = _env.overlay(undefined=jinja2.StrictUndefined)
+
+    _args = args
+    _defaults = load_yaml(os.path.join(ROLE, 'defaults', 'main.yml'))
+    _defaults.update(load_vars(args.group_vars, 'all'))
+    _groups = load_inventory(args.inventory) if args.inventory else dict()
+
+
+def host_vars(host):
+    variables = dict(_defaults)
+    for group in _groups.get(host, ()):
+        if group == 'all':
+            continue
+        if group not in _group_vars:
+            _group_vars[group] = load_vars(_args.group_vars, group)
+        variables.update(_group_vars[group])
+    variables.update(load_vars(_args.host_vars, host))
+    for path in _args.vars:
+        variables.update(load_yaml(path))
+    variables['inventory_hostname'] = host
+    return template_vars(variables)
+
+
+def render(host):
+    try:
+        with open(os.path.join(_args.snapshots, host + _args.suffix)) as f:
+            config = f.read()
+
+        variables = host_vars(host)
+        variables['_eos_config'] = config
+
+        rendered = list()
+        if 'hostname' in variables:
+            rendered.append(
+                _env.get_template('hostname.j2').render(variables))
+        if 'eos_ip_routing_enabled' in variables:
+            rendered.append(
+                _env.get_template('ip_routing.j2').render(variables))
+        for item in variables.get('eos_users') or list():
+            if 'name' in item:
+                rendered.append(_env.get_template('users.j2').render(
+                    dict(variables, item=item)))
+
+        commands = _env.filters['config_plan']('\n'.join(rendered), config)
+        return {'host': host, 'commands': commands}
+    except Exception as exc:
+        return {'host': host, 'error': '%s: %s' % (type(exc).__name__, exc)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Render the EOS System command plan from saved configs')
+    parser.add_argument('--snapshots', required=True,
+                        help='directory holding <host><suffix> configs')
+    parser.add_argument('--suffix', default='.cfg',
+                        help='snapshot file suffix (default: .cfg)')
+    parser.add_argument('--host-vars',
+                        help='directory holding <host>.yml variable files')
+    parser.add_argument('--group-vars',
+                        help='directory holding all.yml and <group>.yml '
+                             'variable files')
+    parser.add_argument('--inventory',
+                        help='INI inventory giving the groups of each host')
+    parser.add_argument('--vars', action='append', default=list(),
+                        help='variable file applied to every host, '
+                             'overriding all other variables')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--chunksize', type=int, default=16,
+                        help='hosts handed to a worker at a time')
+    parser.add_argument('--output', help='write results here, not stdout')
+    parser.add_argument('hosts', nargs='*',
+                        help='hosts to render (default: every snapshot)')
+    args = parser.parse_args()
+
+    hosts = args.hosts or sorted(
+        os.path.basename(path)[:-len(args.suffix)]
+        for path in glob.glob(os.path.join(args.snapshots, '*' + args.suffix)))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    errors = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.processes,
+                                 initializer=init_worker,
+                                 initargs=(args,)) as pool:
+            for result in pool.map(render, hosts, chunksize=args.chunksize):
+                errors += 'error' in result
+                out.write(json.dumps(result) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())